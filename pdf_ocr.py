@@ -1,137 +1,450 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
 import os
-import glob
-import json
+import re
 import shutil
+import signal
 import subprocess
+import sys
+import tempfile
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+import orjson
+
+logger = logging.getLogger(__name__)
 
 # Paths configuration
 BASE_SOURCE_DIR = "./ICIS_test_code"      # Root directory for PDFs (can have subfolders)
-WORKSPACE_DIR = "./localworkspace"   # Temporary working directory for OCR pipeline
-RESULTS_DIR = os.path.join(WORKSPACE_DIR, "results")  # Where OCR pipeline writes JSONL files
 BASE_DEST_DIR = "./ICIS_test_code_md"       # Root directory for generated Markdown (mirrors BASE_SOURCE_DIR)
+WORKSPACE_DIR = "./localworkspace"   # Root directory for the per-batch OCR pipeline workspaces
 
-def clear_workspace():
-    """Clear the workspace directory completely before processing."""
-    if os.path.exists(WORKSPACE_DIR):
-        shutil.rmtree(WORKSPACE_DIR)
-    os.makedirs(WORKSPACE_DIR, exist_ok=True)
-    # Create an empty results folder
-    os.makedirs(RESULTS_DIR, exist_ok=True)
-    print(f"Cleared and re-created workspace: {WORKSPACE_DIR}")
+# File extensions handed to the OCR pipeline, in both cases so that most names can be
+# matched with str.endswith without building a lowercased copy of each one
+EXTS = (".pdf", ".PDF", ".png", ".PNG", ".jpg", ".JPG", ".jpeg", ".JPEG")
+# Fallback for mixed-case names such as scan.Pdf, checked on the lowercased last 5 characters
+LOWER_EXTS = (".pdf", ".png", ".jpg", ".jpeg")
+
+# Normalized BASE_DEST_DIR; every destination folder is spelled in normalized form so that
+# one folder never shows up under two different keys
+ROOT_DEST_DIR = os.path.normpath(BASE_DEST_DIR)
+
+# Records what was last written to each Markdown file, so unchanged outputs are not rewritten
+MANIFEST_FILE = os.path.join(ROOT_DEST_DIR, ".olmocr_manifest.json")
+
+# Scheduling configuration. Every pipeline run starts its own SGLang server, which claims
+# most of a GPU's memory, so each concurrent run gets a slot with a GPU and a port of its own.
+OCR_CONCURRENCY = int(os.environ.get("OCR_CONCURRENCY", "0"))  # Max OCR pipelines running at once (0 = one per GPU)
+OCR_BATCH_SIZE = int(os.environ.get("OCR_BATCH_SIZE", "0"))  # Files per pipeline run (0 = split evenly over the concurrency)
+SGLANG_BASE_PORT = 30024  # Slot i runs its SGLang server on SGLANG_BASE_PORT + i
+
+# Print a progress line every this many Markdown files instead of one line per file
+PROGRESS_EVERY = 1000
+# Markdown writes handed to the writer threads per submission
+WRITE_BATCH_SIZE = 128
+
+# Above this many characters of paths, pass the file list through a list file instead of argv
+MAX_INLINE_PDF_ARGS_LEN = 100_000
+
+# Lines of pipeline stderr (its log output) kept in memory to report a failure
+STDERR_TAIL_LINES = 50
+
+# Retry policy for OCR pipeline runs that fail with a transient error
+OCR_MAX_ATTEMPTS = 3
+# Whole words only, except that "timeout" also matches inside names like TimeoutError and
+# ReadTimeout; a 429 directly after ",", "." or ":" is the milliseconds of a log timestamp
+RETRYABLE_ERRORS = re.compile(r"\b(rate limit|quota|CUDA out of memory)\b|(?<![\w,.:])429\b|timeout", re.I)
+# Only the final lines of stderr (the closing error or traceback) are classified; the log
+# above them routinely mentions timeouts that the pipeline already retried by itself
+RETRY_CHECK_LINES = 5
+# Last line logged when the pipeline gives up on an SGLang server that keeps dying at startup.
+# The reason is in the server's log further up, so then the whole kept tail is classified.
+SGLANG_GAVE_UP_BANNER = "Please make sure sglang is installed"
+SGLANG_RETRYABLE_ERRORS = re.compile(r"\bCUDA out of memory\b", re.I)
+
+def is_retryable_error(stderr):
+    """Return whether a failed pipeline run's stderr ends with a transient error worth retrying."""
+    lines = stderr.rstrip().splitlines()
+    if lines and SGLANG_GAVE_UP_BANNER in lines[-1]:
+        return any(SGLANG_RETRYABLE_ERRORS.search(line) for line in lines)
+    return any(RETRYABLE_ERRORS.search(line) for line in lines[-RETRY_CHECK_LINES:])
+
+def visible_gpus():
+    """
+    Return the ids of the GPUs the pipelines may use: the CUDA_VISIBLE_DEVICES list
+    when it is set, otherwise every GPU nvidia-smi reports (none if it is missing).
+    """
+    if "CUDA_VISIBLE_DEVICES" in os.environ:
+        return [gpu.strip() for gpu in os.environ["CUDA_VISIBLE_DEVICES"].split(",") if gpu.strip()]
+    try:
+        result = subprocess.run(["nvidia-smi", "-L"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    gpu_count = sum(line.startswith("GPU ") for line in result.stdout.splitlines())
+    return [str(i) for i in range(gpu_count)]
+
+async def _stream_stderr(stream, tail):
+    """
+    Pass the pipeline's stderr, where its log goes, through to our stderr as it arrives.
+    Only the last lines are kept, in the bounded deque tail, for the error report.
+    """
+    partial_line = b""
+    while chunk := await stream.read(1 << 16):
+        lines = (partial_line + chunk).split(b"\n")
+        partial_line = lines.pop()
+        if len(partial_line) > 1 << 16:
+            # Flush an overlong unterminated line as is, so memory use never grows with the output
+            lines.append(partial_line)
+            partial_line = b""
+        if lines:
+            # Relay whole lines only, so logs of concurrent pipelines don't interleave mid-line
+            sys.stderr.buffer.write(b"\n".join(lines) + b"\n")
+            sys.stderr.flush()
+            tail.extend(lines)
+    if partial_line:
+        sys.stderr.buffer.write(partial_line + b"\n")
+        sys.stderr.flush()
+        tail.append(partial_line)
+
+def _pdf_args(pdf_files, workspace):
+    """
+    Return the --pdfs arguments for pdf_files. Long lists go through a .txt file of paths
+    in the workspace, which the pipeline reads one per line, to stay under ARG_MAX and avoid
+    copying a huge argv on exec. Note that the pipeline's list loader skips the extension and
+    file signature checks it applies to paths given inline.
+    """
+    if len(" ".join(pdf_files)) <= MAX_INLINE_PDF_ARGS_LEN:
+        return pdf_files
+
+    listed, inline = [], []
+    for pdf_file in pdf_files:
+        # The loader strips each line, so such paths would no longer match their dest_dirs key
+        if pdf_file != pdf_file.strip() or "\n" in pdf_file or "\r" in pdf_file:
+            print(f"Passing {pdf_file!r} inline, its whitespace would be lost in the list file")
+            inline.append(pdf_file)
+        else:
+            listed.append(pdf_file)
+
+    pdf_list_file = os.path.join(workspace, "pdfs.txt")
+    with open(pdf_list_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(listed))
+        f.write("\n")
+    return [pdf_list_file] + inline
 
-def run_ocr_pipeline(pdf_files):
+async def run_ocr_pipeline(pdf_files, workspace, port, env=None):
     """
     Run the OCR pipeline on the given list of pdf_files.
-    The pipeline command uses the WORKSPACE_DIR and expects a list of PDF files.
+    The pipeline command uses the given workspace and SGLang server port, and runs
+    with env (None inherits ours), so several runs can be in flight at the same time.
     """
     # Build the command: pass the workspace and then --pdfs followed by each pdf file.
-    cmd = ["python", "-m", "olmocr.pipeline", WORKSPACE_DIR, "--pdfs"] + pdf_files
+    pdf_args = await asyncio.to_thread(_pdf_args, pdf_files, workspace)
+    cmd = ["python", "-m", "olmocr.pipeline", workspace, "--port", str(port), "--pdfs"] + pdf_args
     print("Running OCR pipeline command:")
     print(" ".join(cmd))
     
-    # Run the command
-    process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if process.returncode != 0:
+    # Run the command, letting the pipeline's output stream straight through. Its log
+    # goes to stderr, which is relayed line by line while only a bounded tail is kept.
+    for attempt in range(OCR_MAX_ATTEMPTS):
+        sys.stdout.flush()
+        # Own process group, so the pipeline can be killed together with its SGLang server
+        process = await asyncio.create_subprocess_exec(*cmd, stderr=asyncio.subprocess.PIPE, start_new_session=True, env=env)
+        stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        try:
+            await _stream_stderr(process.stderr, stderr_tail)
+            await process.wait()
+        except asyncio.CancelledError:
+            # Cancelling the wait doesn't stop the child; kill the whole group rather than
+            # leave the pipeline and its server running as orphans that keep holding a GPU
+            os.killpg(process.pid, signal.SIGKILL)
+            await process.wait()
+            raise
+        if process.returncode == 0:
+            print("OCR pipeline finished successfully.")
+            return True
+
+        stderr = b"\n".join(stderr_tail).decode("utf-8", errors="replace")
+        if attempt + 1 < OCR_MAX_ATTEMPTS and is_retryable_error(stderr):
+            # The workspace keeps finished work items, so a retry resumes where this run stopped
+            delay = min(2**attempt, 30)
+            print(f"OCR pipeline hit a transient error (attempt {attempt + 1}/{OCR_MAX_ATTEMPTS}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+            continue
+
         print("OCR pipeline encountered an error:")
-        print(process.stderr)
+        print(stderr)
         return False
-    else:
-        print("OCR pipeline finished successfully.")
-        return True
 
-def convert_jsonl_to_markdown(output_dir):
+# Guards the manifest shared by the writer threads of concurrently converting batches
+_manifest_lock = threading.Lock()
+
+# Source file -> destination directory mapping, installed in each conversion worker
+_dest_dirs = {}
+
+def _init_worker(dest_dirs):
+    """Store the destination mapping in a conversion worker process."""
+    global _dest_dirs
+    _dest_dirs = dest_dirs
+
+def _render_one_doc(line, jsonl_file):
     """
-    Convert all JSONL files in the RESULTS_DIR into Markdown files.
-    The Markdown files are saved under output_dir.
+    Parse a single JSONL line and render the document as Markdown.
+    Runs inside a worker process started by convert_jsonl_to_markdown and returns
+    (output_dir, name_without_ext, payload, digest), or None if the line is not valid JSON.
     """
-    os.makedirs(output_dir, exist_ok=True)
-    jsonl_files = glob.glob(os.path.join(RESULTS_DIR, "*.jsonl"))
+    try:
+        doc = orjson.loads(line)
+    except orjson.JSONDecodeError as e:
+        print(f"Error decoding JSON in file {jsonl_file}: {e}")
+        return None
     
-    if not jsonl_files:
-        print("No JSONL files found in", RESULTS_DIR)
-        return
+    # Get the source file name from metadata (or fallback to document id)
+    source_file = doc.get("metadata", {}).get("Source-File")
+    if source_file is None:
+        source_file = doc.get("id", "unknown")
+    # Plain string splits are cheaper than os.path.basename and also handle "\\" separators
+    base_name = source_file.rsplit("/", 1)[-1].rsplit("\\", 1)[-1]
+    name_without_ext, _ = os.path.splitext(base_name)
+    # Documents we did not submit ourselves land in the root of BASE_DEST_DIR
+    output_dir = _dest_dirs.get(source_file, ROOT_DEST_DIR)
     
-    for jsonl_file in jsonl_files:
-        print(f"Processing {jsonl_file}...")
-        with open(jsonl_file, "r", encoding="utf-8") as f:
-            for line in f:
-                if not line.strip():
-                    continue
-                try:
-                    doc = json.loads(line)
-                except json.JSONDecodeError as e:
-                    print(f"Error decoding JSON in file {jsonl_file}: {e}")
-                    continue
-                
-                # Get the source file name from metadata (or fallback to document id)
-                metadata = doc.get("metadata", {})
-                source_file = metadata.get("Source-File", doc.get("id", "unknown"))
-                base_name = os.path.basename(source_file)
-                name_without_ext, _ = os.path.splitext(base_name)
-                markdown_filename = os.path.join(output_dir, f"{name_without_ext}.md")
-                
-                # Create Markdown content (header with source file name and OCR text)
-                ocr_text = doc.get("text", "")
-                markdown_content = f"# {base_name}\n\n" + ocr_text
-                
-                with open(markdown_filename, "w", encoding="utf-8") as md_file:
-                    md_file.write(markdown_content)
-                print(f"Created markdown: {markdown_filename}")
-
-def process_directory(source_dir):
-    """
-    Process a single directory that may contain PDF files.
-    This function clears the workspace, runs OCR on PDFs in source_dir,
-    and then converts/moves the results into a corresponding destination folder.
-    """
-    # Get all PDF (or image) files in this directory (non-recursively)
-    pdf_files = glob.glob(os.path.join(source_dir, "*.pdf"))
-    # Optionally add jpg/png if your pipeline supports those
-    pdf_files += glob.glob(os.path.join(source_dir, "*.png"))
-    pdf_files += glob.glob(os.path.join(source_dir, "*.jpg"))
-    pdf_files += glob.glob(os.path.join(source_dir, "*.jpeg"))
+    # Create Markdown content (header with source file name and OCR text)
+    payload = f"# {base_name}\n\n{doc.get('text', '')}".encode("utf-8")
+    # BLAKE2b content hash, compared against the manifest to skip unchanged outputs
+    digest = hashlib.blake2b(payload, digest_size=16).hexdigest()
+    return output_dir, name_without_ext, payload, digest
+
+def _write_all(fd, data):
+    """Write all of data to fd; os.write may write less than it was given."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def load_manifest():
+    """Load the output manifest (Markdown path -> [digest, size, mtime_ns]), or an empty one."""
+    try:
+        with open(MANIFEST_FILE, "rb") as f:
+            return orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return {}
+
+def save_manifest(manifest):
+    """Atomically replace MANIFEST_FILE with the current manifest."""
+    with _manifest_lock:
+        data = orjson.dumps(manifest)
+        # A unique temp file, so concurrent or interrupted saves never clash over one name
+        fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(MANIFEST_FILE), prefix=".olmocr_manifest.")
+        try:
+            _write_all(fd, data)
+        finally:
+            os.close(fd)
+        os.replace(tmp_filename, MANIFEST_FILE)
+
+def _write_markdown(markdown_filename, payload, digest, manifest):
+    """
+    Write the prepared bytes with os.write directly, bypassing the io buffering layer.
+    The write is skipped when the manifest shows that the Markdown file already holds
+    this content and hasn't been touched since. Returns whether the file was written.
+    """
+    entry = manifest.get(markdown_filename)
+    if entry is not None and entry[0] == digest:
+        try:
+            st = os.stat(markdown_filename)
+        except FileNotFoundError:
+            pass
+        else:
+            # Size and mtime catch a file rewritten or edited after the manifest was saved
+            if [st.st_size, st.st_mtime_ns] == entry[1:]:
+                return False
+
+    fd = os.open(markdown_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        _write_all(fd, payload)
+        st = os.fstat(fd)
+    finally:
+        os.close(fd)
+
+    with _manifest_lock:
+        manifest[markdown_filename] = [digest, len(payload), st.st_mtime_ns]
+    return True
+
+def convert_jsonl_to_markdown(results_dir, executor, manifest):
+    """
+    Convert all JSONL files in results_dir into Markdown files.
+    Each document is routed to the destination folder of its source file,
+    looked up in the mapping the executor's workers were initialized with
+    (see _init_worker) by the pipeline's "Source-File" metadata.
+    Lines are independent, so they are parsed in parallel by the executor's process pool;
+    the rendered files are then written grouped by destination folder, in batches
+    spread over a thread pool, skipping files whose content is unchanged since the last run.
+    """
+    # List the results directory once with os.scandir instead of globbing it
+    with os.scandir(results_dir) as entries:
+        jsonl_files = [entry.path for entry in entries if entry.name.endswith(".jsonl")]
     
-    if not pdf_files:
-        print(f"No PDF/image files found in {source_dir}. Skipping.")
+    if not jsonl_files:
+        print("No JSONL files found in", results_dir)
         return
-
-    print(f"\nProcessing directory: {source_dir}")
-    # Clear workspace completely before running this directory
-    clear_workspace()
     
-    # Run OCR pipeline on the pdf files
-    if not run_ocr_pipeline(pdf_files):
-        print(f"Error processing {source_dir}. Skipping conversion.")
+    count = 0
+    unchanged = 0
+    with ThreadPoolExecutor() as writer:
+        for jsonl_file in jsonl_files:
+            logger.info("Processing %s...", jsonl_file)
+            by_dest_dir = defaultdict(dict)  # output_dir -> {name_without_ext: (payload, digest)}
+            # Stream the file line by line in binary mode, orjson parses bytes directly
+            with open(jsonl_file, "rb") as f:
+                # Every document line starts with "{", so only strip the rare other lines
+                # to tell blank ones apart from malformed JSON
+                lines = (line for line in f if line[0] == 0x7B or line.strip())
+                render_doc = partial(_render_one_doc, jsonl_file=jsonl_file)
+                for rendered in executor.map(render_doc, lines, chunksize=64):
+                    if rendered is not None:
+                        output_dir, name_without_ext, payload, digest = rendered
+                        # A later document with the same name replaces the earlier one, as it would on disk
+                        by_dest_dir[output_dir][name_without_ext] = (payload, digest)
+
+            # Write one destination folder at a time, in sorted order, so consecutive
+            # creates hit the same directory while its entries are still cached
+            pending = []  # (markdown_filename, payload, digest)
+            for output_dir in sorted(by_dest_dir):
+                for name_without_ext, (payload, digest) in sorted(by_dest_dir[output_dir].items()):
+                    pending.append((f"{output_dir}/{name_without_ext}.md", payload, digest))
+
+            # Submit the writes in batches; the threads release the GIL in os.open/os.write,
+            # so the syscalls of a batch overlap instead of running back to back
+            for start in range(0, len(pending), WRITE_BATCH_SIZE):
+                batch = pending[start : start + WRITE_BATCH_SIZE]
+                for written in writer.map(partial(_write_markdown, manifest=manifest), *zip(*batch)):
+                    if not written:
+                        unchanged += 1
+                    count += 1
+                    if count % PROGRESS_EVERY == 0:
+                        print(f"Processed {count} markdown files", flush=True)
+
+    print(f"Processed {count} markdown files from {results_dir} ({unchanged} unchanged, not rewritten)")
+
+def collect_pdf_files(source_dir, all_files, dest_dirs):
+    """
+    Recursively scan source_dir for PDF (or image) files.
+    Each directory is read once with os.scandir and its entries are split into
+    subdirectories and matching files in the same pass. Found files are appended
+    to all_files and mapped to their mirrored destination folder in dest_dirs.
+    """
+    subdirs = []
+    pdf_files = []
+    with os.scandir(source_dir) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.is_file(follow_symlinks=False) and (entry.name.endswith(EXTS) or entry.name[-5:].lower().endswith(LOWER_EXTS)):
+                pdf_files.append(entry.path)
+
+    if pdf_files:
+        # Determine the relative path from the base source directory.
+        rel_path = os.path.relpath(source_dir, BASE_SOURCE_DIR)
+        # Normalized, so the top level maps to the same key as ROOT_DEST_DIR instead of "<dir>/."
+        dest_dir = os.path.normpath(os.path.join(BASE_DEST_DIR, rel_path))
+        for pdf_file in pdf_files:
+            dest_dirs[pdf_file] = dest_dir
+        all_files += pdf_files
+    else:
+        print(f"Directory {source_dir} does not contain PDF/image files. Skipping.")
+
+    for subdir in subdirs:
+        collect_pdf_files(subdir, all_files, dest_dirs)
+
+async def process_batch(slots, gpus, batch_index, pdf_files, dest_dirs, executor, manifest):
+    """
+    Run one batch of files through the OCR pipeline and convert its results to Markdown
+    using the shared conversion executor, recording the written files in manifest.
+    The pipeline runs while holding a slot taken from the slots queue; slot i owns
+    GPU gpus[i] (when any were found) and SGLang port SGLANG_BASE_PORT + i.
+    """
+    slot = await slots.get()
+    try:
+        # Each batch gets a fresh, isolated workspace, so there is nothing to clear
+        # and concurrent pipelines never share a work queue
+        workspace = tempfile.mkdtemp(prefix="olmocr_", dir=WORKSPACE_DIR)
+        print(f"\nProcessing batch {batch_index} ({len(pdf_files)} files) in workspace {workspace}")
+        # The pipeline always starts its server on its first visible GPU, so show it only the slot's own
+        env = {**os.environ, "CUDA_VISIBLE_DEVICES": gpus[slot]} if gpus else None
+        if not await run_ocr_pipeline(pdf_files, workspace, SGLANG_BASE_PORT + slot, env):
+            print(f"Error processing batch {batch_index}. Skipping conversion, workspace kept at {workspace}")
+            return
+    finally:
+        slots.put_nowait(slot)
+
+    # Create each destination folder of the batch once (deduplicated through a set)
+    # before any Markdown is written; unknown documents go to BASE_DEST_DIR itself
+    for output_dir in {ROOT_DEST_DIR, *(dest_dirs[pdf_file] for pdf_file in pdf_files)}:
+        os.makedirs(output_dir, exist_ok=True)
+
+    # Convert after releasing the slot so the next batch can start its pipeline meanwhile,
+    # and in a thread so the event loop keeps draining the other pipelines' stderr.
+    await asyncio.to_thread(convert_jsonl_to_markdown, os.path.join(workspace, "results"), executor, manifest)
+    await asyncio.to_thread(save_manifest, manifest)
+
+    # Delete the workspace in the background; the thread is not a daemon, so the
+    # interpreter still waits for it to finish before exiting
+    threading.Thread(target=shutil.rmtree, args=(workspace,), kwargs={"ignore_errors": True}).start()
+
+async def main():
+    """
+    Walk through BASE_SOURCE_DIR recursively and collect every PDF (or image) file,
+    then run the OCR pipeline over them in as few batches as possible so that
+    interpreter and model startup is paid rarely. Batches are scheduled with up to
+    OCR_CONCURRENCY pipelines (by default one per GPU) in flight. The results are
+    converted to Markdown in folders under BASE_DEST_DIR that mirror the source layout.
+    """
+    if OCR_CONCURRENCY < 0 or OCR_BATCH_SIZE < 0:
+        raise ValueError(f"OCR_CONCURRENCY and OCR_BATCH_SIZE must be at least 0, got {OCR_CONCURRENCY} and {OCR_BATCH_SIZE}")
+    gpus = visible_gpus()
+    concurrency = OCR_CONCURRENCY or max(len(gpus), 1)
+    if concurrency > max(len(gpus), 1):
+        raise ValueError(f"OCR_CONCURRENCY={concurrency} needs a GPU per pipeline, but only {len(gpus)} are visible")
+
+    all_files = []
+    dest_dirs = {}  # source file -> destination directory for its markdown
+    collect_pdf_files(BASE_SOURCE_DIR, all_files, dest_dirs)
+
+    if not all_files:
+        print(f"No PDF/image files found under {BASE_SOURCE_DIR}.")
         return
 
-    # Determine the relative path from the base source directory.
-    rel_path = os.path.relpath(source_dir, BASE_SOURCE_DIR)
-    # Create a corresponding destination directory for markdown outputs
-    dest_dir = os.path.join(BASE_DEST_DIR, rel_path)
-    os.makedirs(dest_dir, exist_ok=True)
-    
-    # Convert the JSONL results to Markdown in the destination directory.
-    convert_jsonl_to_markdown(dest_dir)
-    
-    # Optionally, move the JSONL files from the workspace to a backup location
-    # (if you want to keep them separate, here we simply remove them after conversion).
-    if os.path.exists(RESULTS_DIR):
-        shutil.rmtree(RESULTS_DIR)
-        os.makedirs(RESULTS_DIR, exist_ok=True)
-        print(f"Moved (cleared) JSONL results for {source_dir}")
-
-def main():
-    """
-    Walk through BASE_SOURCE_DIR recursively.
-    For each directory that contains at least one PDF (or image) file,
-    process it using the OCR pipeline and then convert the output to Markdown.
-    """
-    for root, dirs, files in os.walk(BASE_SOURCE_DIR):
-        # Check if this directory contains any files with .pdf, .png, .jpg, or .jpeg extension.
-        if any(file.lower().endswith((".pdf", ".png", ".jpg", ".jpeg")) for file in files):
-            process_directory(root)
-        else:
-            print(f"Directory {root} does not contain PDF/image files. Skipping.")
+    os.makedirs(WORKSPACE_DIR, exist_ok=True)
+
+    # Keep directories together by splitting the (walk-ordered) file list into contiguous batches
+    batch_size = OCR_BATCH_SIZE or -(-len(all_files) // concurrency)
+    batches = [all_files[i : i + batch_size] for i in range(0, len(all_files), batch_size)]
+    print(f"\nProcessing {len(all_files)} files from {BASE_SOURCE_DIR} in {len(batches)} batch(es)")
+
+    # One conversion pool shared by all batches, so concurrent conversions don't each start
+    # cpu_count() workers. Workers are started lazily from a conversion thread, so they
+    # come from a forkserver rather than forking this multi-threaded process.
+    with ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        mp_context=multiprocessing.get_context("forkserver"),
+        initializer=_init_worker,
+        initargs=(dest_dirs,),
+    ) as executor:
+        manifest = load_manifest()
+        slots = asyncio.Queue()
+        for slot in range(concurrency):
+            slots.put_nowait(slot)
+        # Collect exceptions instead of letting the first one cancel every other batch
+        results = await asyncio.gather(
+            *(process_batch(slots, gpus, i, batch, dest_dirs, executor, manifest) for i, batch in enumerate(batches)), return_exceptions=True
+        )
+
+    for batch_index, result in enumerate(results):
+        if isinstance(result, BaseException):
+            print(f"Error processing batch {batch_index}: {type(result).__name__}: {result}")
 
 if __name__ == "__main__":
-    main()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main())
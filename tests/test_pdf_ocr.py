@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pdf_ocr
+from pdf_ocr import _write_markdown, is_retryable_error, load_manifest, save_manifest
+
+
+class RetryableErrorTest(unittest.TestCase):
+    def testTransientErrorAtEnd(self):
+        stderr = "\n".join(
+            [
+                "2026-10-15 07:46:40,101 - olmocr.pipeline - INFO - Starting pipeline",
+                "Traceback (most recent call last):",
+                '  File "pipeline.py", line 1, in <module>',
+                "torch.OutOfMemoryError: CUDA out of memory. Tried to allocate 2.00 GiB",
+            ]
+        )
+        self.assertTrue(is_retryable_error(stderr))
+        self.assertTrue(is_retryable_error("openai.RateLimitError: Error code: 429 - rate limit reached\n"))
+
+    def testLogTimestampIsNotA429(self):
+        stderr = "\n".join(f"2026-10-15 07:46:47,429 - olmocr.pipeline - INFO - Finished page {i}" for i in range(10))
+        self.assertFalse(is_retryable_error(stderr))
+
+    def testRoutineTimeoutsEarlierInLogAreIgnored(self):
+        lines = [
+            "2026-10-15 07:46:47,100 - olmocr.pipeline - WARNING - Client error on attempt 0 for a.pdf-1: <class 'httpx.ReadTimeout'>",
+            "2026-10-15 07:46:48,100 - olmocr.pipeline - WARNING - Client error on attempt 1 for a.pdf-1: <class 'TimeoutError'>",
+        ]
+        lines += [f"2026-10-15 07:46:49,{i:03d} - olmocr.pipeline - INFO - Finished page {i}" for i in range(10)]
+        lines += ["Traceback (most recent call last):", "ValueError: Could not parse PDF"]
+        self.assertFalse(is_retryable_error("\n".join(lines)))
+
+    def testTimeoutInFinalError(self):
+        self.assertTrue(is_retryable_error("asyncio.exceptions.CancelledError\nRuntimeError: request timeout while contacting server\n"))
+        self.assertTrue(is_retryable_error("httpx.ReadTimeout: read operation timed out\n"))
+        self.assertTrue(is_retryable_error("Traceback (most recent call last):\nasyncio.TimeoutError\n"))
+        self.assertTrue(is_retryable_error("Traceback (most recent call last):\nTimeoutError\n"))
+
+    def testSGLangStartupFailure(self):
+        def stderr(server_error):
+            lines = [
+                "2026-10-15 07:46:40,101 - olmocr.pipeline - INFO - Starting pipeline",
+                f"2026-10-15 07:46:45,101 - olmocr.pipeline - INFO - {server_error}",
+            ]
+            lines += [f"2026-10-15 07:46:46,{i:03d} - olmocr.pipeline - WARNING - SGLang server task ended" for i in range(5)]
+            lines += [
+                "2026-10-15 07:47:00,000 - olmocr.pipeline - ERROR - Ended up starting the sglang server more than 5 times, cancelling pipeline",
+                "2026-10-15 07:47:00,000 - olmocr.pipeline - ERROR - ",
+                "2026-10-15 07:47:00,000 - olmocr.pipeline - ERROR - Please make sure sglang is installed according to the latest instructions here: https://docs.sglang.ai/start/install.html",
+            ]
+            return "\n".join(lines) + "\n"
+
+        self.assertTrue(is_retryable_error(stderr("torch.OutOfMemoryError: CUDA out of memory. Tried to allocate 2.00 GiB")))
+        self.assertFalse(is_retryable_error(stderr("ModuleNotFoundError: No module named 'sglang'")))
+
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        manifest_patch = mock.patch.object(pdf_ocr, "MANIFEST_FILE", os.path.join(tmp_dir.name, ".olmocr_manifest.json"))
+        manifest_patch.start()
+        self.addCleanup(manifest_patch.stop)
+        self.markdown_filename = os.path.join(tmp_dir.name, "doc.md")
+
+    def testUnchangedOutputIsSkipped(self):
+        manifest = {}
+        self.assertTrue(_write_markdown(self.markdown_filename, b"# doc\n\ntext", "digest", manifest))
+        with open(self.markdown_filename, "rb") as f:
+            self.assertEqual(f.read(), b"# doc\n\ntext")
+        self.assertFalse(_write_markdown(self.markdown_filename, b"# doc\n\ntext", "digest", manifest))
+        self.assertTrue(_write_markdown(self.markdown_filename, b"# doc\n\nnew text", "new digest", manifest))
+
+    def testEditedOutputIsRewritten(self):
+        manifest = {}
+        _write_markdown(self.markdown_filename, b"# doc\n\ntext", "digest", manifest)
+        with open(self.markdown_filename, "wb") as f:
+            f.write(b"edited")
+        self.assertTrue(_write_markdown(self.markdown_filename, b"# doc\n\ntext", "digest", manifest))
+
+        # An edit that keeps the size is caught by the mtime
+        with open(self.markdown_filename, "wb") as f:
+            f.write(b"# DOC\n\ntext")
+        st = os.stat(self.markdown_filename)
+        os.utime(self.markdown_filename, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        self.assertTrue(_write_markdown(self.markdown_filename, b"# doc\n\ntext", "digest", manifest))
+        with open(self.markdown_filename, "rb") as f:
+            self.assertEqual(f.read(), b"# doc\n\ntext")
+
+    def testDeletedOutputIsRewritten(self):
+        manifest = {}
+        _write_markdown(self.markdown_filename, b"# doc\n\ntext", "digest", manifest)
+        os.remove(self.markdown_filename)
+        self.assertTrue(_write_markdown(self.markdown_filename, b"# doc\n\ntext", "digest", manifest))
+        self.assertTrue(os.path.exists(self.markdown_filename))
+
+    def testManifestRoundTrip(self):
+        self.assertEqual(load_manifest(), {})
+        manifest = {}
+        _write_markdown(self.markdown_filename, b"# doc\n\ntext", "digest", manifest)
+        save_manifest(manifest)
+        loaded = load_manifest()
+        self.assertEqual(loaded, manifest)
+        self.assertFalse(_write_markdown(self.markdown_filename, b"# doc\n\ntext", "digest", loaded))
+
+    def testCorruptManifestIsIgnored(self):
+        with open(pdf_ocr.MANIFEST_FILE, "wb") as f:
+            f.write(b'{"doc.md": ["digest", 12')
+        self.assertEqual(load_manifest(), {})